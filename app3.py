@@ -1,13 +1,26 @@
-import streamlit as st
-import pandas as pd
+import atexit
+import io
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import streamlit as st
 from PIL import Image
-import time
 
 # ---------------- CONFIG ----------------
 IMAGE_FOLDER = Path("images")
 DATA_FOLDER = Path("data")
-MASTER_FILE = DATA_FOLDER / "reviews_master.csv"
+# All reviews live in one WAL-journaled SQLite database keyed on
+# (Reviewer, ImageName): submits are O(1) INSERTs, edits are UPDATEs, and
+# concurrent reviewers are safe without app-level file juggling. CSV only
+# exists as the in-memory export in the Download branch. The previous
+# Parquet dataset (and, before that, per-reviewer CSVs) are imported once.
+DB_FILE = DATA_FOLDER / "reviews.db"
+LEGACY_PARQUET_DATASET = DATA_FOLDER / "reviews.parquet"
 DATA_FOLDER.mkdir(exist_ok=True)
 
 st.set_page_config(page_title="🦠 Bacterial vs Fungal Review", layout="wide")
@@ -25,30 +38,213 @@ if not reviewer:
     st.warning("Please enter your name or ID to begin.")
     st.stop()
 
-# Reviewer-specific file
+# Legacy reviewer-specific CSV (pre-Parquet installs), imported once below
 REVIEWER_FILE = DATA_FOLDER / f"reviews_{reviewer}.csv"
 
 # ---------------- Load Images ----------------
-images = list(IMAGE_FOLDER.glob("*.*"))
-images.sort()
-image_names = [img.name for img in images]
+THUMBS_FOLDER = IMAGE_FOLDER / ".thumbs"
+
+
+@st.cache_data(show_spinner=False)
+def list_images(folder_mtime: float) -> list[str]:
+    # folder_mtime is only a cache key: the folder is rescanned when it
+    # changes. os.scandir walks the directory in a single cursor, reusing
+    # the d_type the kernel already returned instead of one stat per entry.
+    # Hidden entries (the .thumbs cache) are skipped.
+    return sorted(
+        entry.name
+        for entry in os.scandir(IMAGE_FOLDER)
+        if entry.is_file() and "." in entry.name and not entry.name.startswith(".")
+    )
+
+image_names = list_images(IMAGE_FOLDER.stat().st_mtime)
+images = [IMAGE_FOLDER / name for name in image_names]
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def load_preview(path: str, mtime: float, max_side: int = 1280) -> bytes:
+    # max_entries keeps a bounded LRU so large image sets don't pin the
+    # whole collection's preview bytes in RAM. The resized JPEG is also
+    # persisted under images/.thumbs on first view, so the full-resolution
+    # decode happens once per image ever, not once per session.
+    thumb = THUMBS_FOLDER / Path(path).name
+    if thumb.exists() and thumb.stat().st_mtime >= mtime:
+        return thumb.read_bytes()
+    # draft() lets libjpeg decode at a reduced DCT scale (1/2, 1/4, 1/8)
+    # instead of the full resolution the browser would downscale anyway.
+    im = Image.open(path)
+    im.draft("RGB", (max_side, max_side))
+    im.thumbnail((max_side, max_side), Image.BILINEAR)
+    if im.mode not in ("RGB", "L"):
+        im = im.convert("RGB")
+    buf = io.BytesIO()
+    im.save(buf, "JPEG", quality=82, optimize=True, progressive=True)
+    data = buf.getvalue()
+    THUMBS_FOLDER.mkdir(exist_ok=True)
+    thumb.write_bytes(data)
+    return data
+
+
+@st.cache_resource(show_spinner=False)
+def _executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=2)
 
 # ---------------- Load Previous Reviews Safely ----------------
-if REVIEWER_FILE.exists():
-    try:
-        reviewed = pd.read_csv(REVIEWER_FILE)
-        if reviewed.empty or "ImageName" not in reviewed.columns:
-            reviewed = pd.DataFrame(columns=["Reviewer", "ImageName", "Condition", "DiagnosticNote", "Feedback"])
-    except Exception as e:
-        st.warning(f"⚠️ Could not read your previous file. Starting fresh.\n\nError: {e}")
-        reviewed = pd.DataFrame(columns=["Reviewer", "ImageName", "Condition", "DiagnosticNote", "Feedback"])
-else:
-    reviewed = pd.DataFrame(columns=["Reviewer", "ImageName", "Condition", "DiagnosticNote", "Feedback"])
+REVIEW_COLUMNS = ["Reviewer", "ImageName", "Condition", "DiagnosticNote", "Feedback"]
+CONDITIONS = ["Bacterial", "Fungal", "Others", "Not Sure"]
+# Arrow-backed strings keep the columns in contiguous buffers instead of
+# per-row Python objects; Condition stays a fixed categorical so isin/equality
+# run over dictionary codes.
+REVIEW_DTYPES = {
+    "Reviewer": pd.ArrowDtype(pa.string()),
+    "ImageName": pd.ArrowDtype(pa.string()),
+    "Condition": pd.CategoricalDtype(CONDITIONS),
+    "DiagnosticNote": pd.ArrowDtype(pa.string()),
+    "Feedback": pd.ArrowDtype(pa.string()),
+}
+
+
+@st.cache_resource(show_spinner=False)
+def _dataset_lock() -> threading.Lock:
+    # Serializes writes on the shared connection across session threads;
+    # SQLite's own file locking covers any other process on the same DB.
+    return threading.Lock()
+
+
+@st.cache_resource(show_spinner=False)
+def _db() -> sqlite3.Connection:
+    con = sqlite3.connect(DB_FILE, isolation_level=None, check_same_thread=False)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS reviews(
+            Reviewer TEXT NOT NULL,
+            ImageName TEXT NOT NULL,
+            Condition TEXT,
+            DiagnosticNote TEXT,
+            Feedback TEXT,
+            PRIMARY KEY (Reviewer, ImageName)
+        )
+        """
+    )
+    # One-time import of the pre-SQLite Parquet dataset
+    empty = con.execute("SELECT NOT EXISTS(SELECT 1 FROM reviews)").fetchone()[0]
+    if empty and LEGACY_PARQUET_DATASET.exists():
+        legacy = pd.read_parquet(LEGACY_PARQUET_DATASET)[REVIEW_COLUMNS]
+        con.executemany(
+            "INSERT OR IGNORE INTO reviews VALUES (?, ?, ?, ?, ?)",
+            ([None if pd.isna(v) else str(v) for v in row]
+             for row in legacy.itertuples(index=False)),
+        )
+    return con
+
 
-reviewed_images = reviewed["ImageName"].tolist()
+def data_version() -> int:
+    # Monotonic write counter on the shared connection, used as a cache key
+    # so readers pick up every insert/update/delete.
+    return _db().total_changes
+
+
+@st.cache_data(show_spinner=False)
+def load_reviews(reviewer_name: str, version: int) -> pd.DataFrame:
+    df = pd.read_sql_query(
+        "SELECT Reviewer, ImageName, Condition, DiagnosticNote, Feedback"
+        " FROM reviews WHERE Reviewer = ? ORDER BY ImageName",
+        _db(),
+        params=(reviewer_name,),
+    )
+    return df.astype(REVIEW_DTYPES)
+
+
+@st.cache_data(show_spinner=False)
+def get_csv_bytes(reviewer_name: str, version: int) -> bytes:
+    # Serialized once per data version; reruns of the Download branch hand
+    # the same bytes straight to st.download_button.
+    return load_reviews(reviewer_name, version).to_csv(index=False).encode("utf-8")
+
+
+def save_reviews(rows: list[dict]) -> None:
+    with _dataset_lock():
+        _db().executemany(
+            "INSERT OR REPLACE INTO reviews VALUES"
+            " (:Reviewer, :ImageName, :Condition, :DiagnosticNote, :Feedback)",
+            rows,
+        )
+    load_reviews.clear()
+
+
+def update_review(reviewer_name: str, image_name: str, condition: str,
+                  note: str, feedback: str) -> None:
+    with _dataset_lock():
+        _db().execute(
+            "UPDATE reviews SET Condition = ?, DiagnosticNote = ?, Feedback = ?"
+            " WHERE Reviewer = ? AND ImageName = ?",
+            (condition, note, feedback, reviewer_name, image_name),
+        )
+    load_reviews.clear()
+
+
+def delete_reviews(reviewer_name: str, image_names_to_drop: list[str]) -> None:
+    with _dataset_lock():
+        _db().executemany(
+            "DELETE FROM reviews WHERE Reviewer = ? AND ImageName = ?",
+            [(reviewer_name, name) for name in image_names_to_drop],
+        )
+    load_reviews.clear()
+
+
+# ---------------- Pending Review Buffer ----------------
+# Submits are buffered in session_state and flushed in batches, so ten
+# reviews cost one dataset write instead of ten.
+PENDING_FLUSH_EVERY = 10
+
+if "pending_reviews" not in st.session_state:
+    st.session_state["pending_reviews"] = _pending = []
+    # Last-resort flush if the server exits with rows still buffered
+    atexit.register(lambda: _pending and save_reviews(_pending))
+
+pending_reviews = st.session_state["pending_reviews"]
+
+
+def flush_pending() -> None:
+    if pending_reviews:
+        save_reviews(pending_reviews)
+        pending_reviews.clear()
+
+
+# ---------------- Sidebar ----------------
+with st.sidebar:
+    st.header("🔍 Quick Actions")
+    mode = st.radio("Mode:", ["Review New", "Edit Reviews", "Download CSV"], horizontal=False)
+
+# Buffered submits must be on disk before Edit/Download read the dataset
+if mode != "Review New":
+    flush_pending()
+
+# One-time import of a pre-Parquet CSV into this reviewer's rows. The
+# existence probe itself runs once per session per reviewer, not per rerun.
+if st.session_state.get("legacy_checked_for") != reviewer:
+    has_rows = _db().execute(
+        "SELECT EXISTS(SELECT 1 FROM reviews WHERE Reviewer = ?)", (reviewer,)
+    ).fetchone()[0]
+    if REVIEWER_FILE.exists() and not has_rows:
+        try:
+            save_reviews(pd.read_csv(REVIEWER_FILE).to_dict("records"))
+        except Exception as e:
+            st.warning(f"⚠️ Could not import your old CSV file.\n\nError: {e}")
+    st.session_state["legacy_checked_for"] = reviewer
+
+try:
+    reviewed = load_reviews(reviewer, data_version())
+except Exception as e:
+    st.warning(f"⚠️ Could not read your previous reviews. Starting fresh.\n\nError: {e}")
+    reviewed = pd.DataFrame(columns=REVIEW_COLUMNS)
+
+reviewed_set = set(reviewed["ImageName"].values)
+image_set = frozenset(image_names)
 
 # ---------------- Filter Bad Entries ----------------
-missing_files = [img for img in reviewed_images if img not in image_names]
+missing_files = sorted(reviewed_set - image_set)
 
 if missing_files:
     st.warning("⚠️ These reviewed images do NOT exist in your images/ folder:")
@@ -56,23 +252,42 @@ if missing_files:
 
     # Drop missing entries to avoid app crash
     reviewed = reviewed[~reviewed["ImageName"].isin(missing_files)]
-    reviewed.to_csv(REVIEWER_FILE, index=False)
+    delete_reviews(reviewer, missing_files)
+    reviewed_set -= set(missing_files)
+
+# O(1) ImageName -> row-index lookups for the Edit branch, rebuilt only when
+# the reviewer or their data changes.
+_idx_key = (reviewer, data_version())
+if st.session_state.get("name_to_idx_key") != _idx_key:
+    st.session_state["name_to_idx"] = dict(zip(reviewed["ImageName"], reviewed.index))
+    st.session_state["name_to_idx_key"] = _idx_key
+name_to_idx = st.session_state["name_to_idx"]
+
+# Buffered rows count as reviewed even though they are not on disk yet
+reviewed_set |= {row["ImageName"] for row in pending_reviews}
 
-remaining_images = [img for img in images if img.name not in reviewed["ImageName"].tolist()]
+remaining_images = [img for img in images if img.name not in reviewed_set]
 total_images = len(images)
-completed = len(reviewed)
+completed = len(reviewed) + len(pending_reviews)
 remaining = len(remaining_images)
 
-# ---------------- Sidebar ----------------
+# ---------------- Sidebar Stats ----------------
 with st.sidebar:
-    st.header("🔍 Quick Actions")
-    mode = st.radio("Mode:", ["Review New", "Edit Reviews", "Download CSV"], horizontal=False)
     st.markdown("---")
     st.write(f"👩‍⚕️ **Reviewer:** `{reviewer}`")
     st.progress(completed / total_images if total_images > 0 else 0)
     st.caption(f"✅ Completed: {completed} / {total_images}")
     st.caption(f"🕒 Remaining: {remaining}")
 
+# Confirmation for the save that triggered the current rerun
+save_note = st.session_state.pop("save_note", None)
+if save_note:
+    st.toast(save_note, icon="✅")
+
+# Each mode's panel runs as a fragment: interacting with widgets inside it
+# reruns only the fragment, not the whole script. Saves still call
+# st.rerun(), which reruns the full app so the sidebar progress updates.
+
 # ---------------- Review New Images ----------------
 if mode == "Review New":
     if not remaining_images:
@@ -81,62 +296,74 @@ if mode == "Review New":
 
     current_image = remaining_images[0]
 
-    c1, c2 = st.columns([0.55, 0.45])
+    @st.fragment
+    def review_fragment():
+        c1, c2 = st.columns([0.55, 0.45])
+
+        with c1:
+            # Safe image loading
+            try:
+                st.image(
+                    load_preview(str(current_image), current_image.stat().st_mtime),
+                    caption=current_image.name,
+                    use_container_width=True
+                )
+            except:
+                st.error(f"❌ Cannot open image: {current_image.name}")
+                st.stop()
 
-    with c1:
-        # Safe image loading
-        try:
-            st.image(Image.open(current_image), caption=current_image.name, use_container_width=True)
-        except:
-            st.error(f"❌ Cannot open image: {current_image.name}")
-            st.stop()
+            st.markdown(f"**Progress:** {completed + 1} / {total_images}")
 
-        st.markdown(f"**Progress:** {completed + 1} / {total_images}")
+            # Warm the preview cache for the upcoming images in the background so
+            # the rerun after a submit finds their bytes already decoded. No
+            # .result() — the load_preview call populates st.cache_data itself.
+            for upcoming in remaining_images[1:3]:
+                _executor().submit(load_preview, str(upcoming), upcoming.stat().st_mtime)
 
-    with c2:
-        with st.form(key=f"review_form_{current_image.name}", border=True):
-            st.markdown(f"### 🖼️ Reviewing: `{current_image.name}`")
+        with c2:
+            with st.form(key=f"review_form_{current_image.name}", clear_on_submit=True, border=True):
+                st.markdown(f"### 🖼️ Reviewing: `{current_image.name}`")
             
-            condition = st.radio(
-                "Select Condition:", 
-                ["Bacterial", "Fungal", "Others", "Not Sure"],
-                horizontal=True,
-                index=0
-            )
+                condition = st.radio(
+                    "Select Condition:",
+                    CONDITIONS,
+                    horizontal=True,
+                    index=0
+                )
 
-            margin_note = st.text_area(
-                "Diagnostic Notes (if any):", 
-                value="", 
-                placeholder="Example: 'Satellite lesions — suggests Fungal.'",
-                height=60
-            )
+                margin_note = st.text_area(
+                    "Diagnostic Notes (if any):", 
+                    value="", 
+                    placeholder="Example: 'Satellite lesions — suggests Fungal.'",
+                    height=60
+                )
 
-            feedback = st.text_area(
-                "Feedback (optional):", 
-                value="", 
-                placeholder="Example: 'Image slightly blurred.'", 
-                height=60
-            )
+                feedback = st.text_area(
+                    "Feedback (optional):", 
+                    value="", 
+                    placeholder="Example: 'Image slightly blurred.'", 
+                    height=60
+                )
+
+                submit = st.form_submit_button("✅ Submit Review", use_container_width=True)
 
-            submit = st.form_submit_button("✅ Submit Review", use_container_width=True)
+                if submit:
+                    new_data = {
+                        "Reviewer": reviewer,
+                        "ImageName": current_image.name,
+                        "Condition": condition,
+                        "DiagnosticNote": margin_note.strip(),
+                        "Feedback": feedback.strip()
+                    }
 
-            if submit:
-                new_data = {
-                    "Reviewer": reviewer,
-                    "ImageName": current_image.name,
-                    "Condition": condition,
-                    "DiagnosticNote": margin_note.strip(),
-                    "Feedback": feedback.strip()
-                }
+                    pending_reviews.append(new_data)
+                    if len(pending_reviews) >= PENDING_FLUSH_EVERY:
+                        flush_pending()
 
-                df_new = pd.DataFrame([new_data])
-                df_new.to_csv(REVIEWER_FILE, mode='a', header=not REVIEWER_FILE.exists(), index=False)
-                df_new.to_csv(MASTER_FILE, mode='a', header=not MASTER_FILE.exists(), index=False)
+                    st.session_state["save_note"] = f"Review for {current_image.name} saved!"
+                    st.rerun()
 
-                st.success(f"✅ Review for `{current_image.name}` saved!")
-                st.toast("Saved successfully — loading next image...", icon="✅")
-                time.sleep(1.5)
-                st.rerun()
+    review_fragment()
 
 # ---------------- Edit Previous Reviews ----------------
 elif mode == "Edit Reviews":
@@ -145,85 +372,88 @@ elif mode == "Edit Reviews":
         st.info("No reviews found yet. Please review some images first.")
         st.stop()
 
-    c1, c2 = st.columns([0.4, 0.6])
+    @st.fragment
+    def edit_fragment():
+        c1, c2 = st.columns([0.4, 0.6])
 
-    with c1:
-        selected_image = st.selectbox("Select image:", reviewed["ImageName"].tolist())
-        img_path = IMAGE_FOLDER / selected_image
+        with c1:
+            selected_image = st.selectbox("Select image:", reviewed["ImageName"].tolist())
+            img_path = IMAGE_FOLDER / selected_image
 
-        if img_path.exists():
-            st.image(Image.open(img_path), caption=selected_image, use_container_width=True)
-        else:
-            st.error(f"❌ Image not found: {selected_image}")
-            st.stop()
+            if img_path.exists():
+                st.image(
+                    load_preview(str(img_path), img_path.stat().st_mtime),
+                    caption=selected_image,
+                    use_container_width=True
+                )
+            else:
+                st.error(f"❌ Image not found: {selected_image}")
+                st.stop()
 
-    with c2:
-        prev = reviewed[reviewed["ImageName"] == selected_image].iloc[0]
+        with c2:
+            prev = reviewed.loc[name_to_idx[selected_image]]
 
-        with st.form(key=f"edit_form_{selected_image}", border=True):
-            st.markdown(f"### ✏️ Edit Review for `{selected_image}`")
+            with st.form(key=f"edit_form_{selected_image}", clear_on_submit=True, border=True):
+                st.markdown(f"### ✏️ Edit Review for `{selected_image}`")
 
-            condition = st.radio(
-                "Condition:",
-                ["Bacterial", "Fungal", "Others", "Not Sure"],
-                horizontal=True,
-                index=["Bacterial", "Fungal", "Others", "Not Sure"].index(prev["Condition"])
-            )
+                condition = st.radio(
+                    "Condition:",
+                    CONDITIONS,
+                    horizontal=True,
+                    index=CONDITIONS.index(prev["Condition"])
+                )
 
-            margin_note = st.text_area(
-                "Diagnostic Notes:",
-                value=prev.get("DiagnosticNote", ""),
-                height=60
-            )
+                margin_note = st.text_area(
+                    "Diagnostic Notes:",
+                    value=prev.get("DiagnosticNote", ""),
+                    height=60
+                )
 
-            feedback = st.text_area(
-                "Feedback / comments:",
-                value=prev.get("Feedback", ""),
-                height=60
-            )
+                feedback = st.text_area(
+                    "Feedback / comments:",
+                    value=prev.get("Feedback", ""),
+                    height=60
+                )
 
-            update = st.form_submit_button("💾 Update Review", use_container_width=True)
+                update = st.form_submit_button("💾 Update Review", use_container_width=True)
 
-            if update:
-                idx = reviewed[reviewed["ImageName"] == selected_image].index[0]
-                reviewed.loc[idx, ["Condition", "DiagnosticNote", "Feedback"]] = [
-                    condition, margin_note.strip(), feedback.strip()
-                ]
-                reviewed.to_csv(REVIEWER_FILE, index=False)
+                if update:
+                    update_review(
+                        reviewer, selected_image,
+                        condition, margin_note.strip(), feedback.strip()
+                    )
 
-                all_files = list(DATA_FOLDER.glob("reviews_*.csv"))
-                merged = pd.concat(
-                    [pd.read_csv(f) for f in all_files if f.name != "reviews_master.csv"],
-                    ignore_index=True
-                )
-                merged.to_csv(MASTER_FILE, index=False)
+                    st.session_state["save_note"] = f"Updated review for {selected_image}!"
+                    st.rerun()
 
-                st.success(f"✅ Updated review for `{selected_image}`!")
-                st.toast("Review updated — refreshing...", icon="🔄")
-                time.sleep(1.5)
-                st.rerun()
+    edit_fragment()
 
 # ---------------- Download CSV ----------------
 else:
-    if not REVIEWER_FILE.exists():
-        st.info("No reviews available yet.")
-        st.stop()
+    @st.fragment
+    def download_fragment():
+        version = data_version()
+        df = load_reviews(reviewer, version)
+        if df.empty:
+            st.info("No reviews available yet.")
+            st.stop()
 
-    c1, c2 = st.columns([0.6, 0.4])
-
-    with c1:
-        st.markdown("### 📥 My Review Summary")
-        df = pd.read_csv(REVIEWER_FILE)
-        st.dataframe(df, height=300, use_container_width=True)
-
-    with c2:
-        st.markdown("### ⬇️ Download")
-        csv_data = df.to_csv(index=False).encode("utf-8")
-        st.download_button(
-            "Download My Reviews (CSV)",
-            csv_data,
-            f"{reviewer}_reviews.csv",
-            "text/csv",
-            use_container_width=True
-        )
-        st.success("✅ Download ready!")
+        c1, c2 = st.columns([0.6, 0.4])
+
+        with c1:
+            st.markdown("### 📥 My Review Summary")
+            st.dataframe(df, height=300, use_container_width=True)
+
+        with c2:
+            st.markdown("### ⬇️ Download")
+            csv_data = get_csv_bytes(reviewer, version)
+            st.download_button(
+                "Download My Reviews (CSV)",
+                csv_data,
+                f"{reviewer}_reviews.csv",
+                "text/csv",
+                use_container_width=True
+            )
+            st.success("✅ Download ready!")
+
+    download_fragment()